@@ -1,14 +1,20 @@
 import os
-import pickle
+import mmap
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import tiktoken
+import faiss
+from openai import OpenAI
 
 # LangChain imports
-from langchain.text_splitter import CharacterTextSplitter
+from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.embeddings import OpenAIEmbeddings
 from langchain.vectorstores import FAISS
-from langchain.chains import RetrievalQA
-from langchain.chat_models import ChatOpenAI
+from langchain.docstore.in_memory import InMemoryDocstore
 
 # -------------------------------
 # 1️⃣ Streamlit Setup
@@ -21,91 +27,259 @@ st.title("Agentic AI – SOP Query Interface")
 # -------------------------------
 base_dir = os.path.dirname(__file__)
 output_dir = os.path.join(base_dir, "output")
-kb_pickle = os.path.join(base_dir, "preprocessed_kb.pkl")
-embeddings_pickle = os.path.join(base_dir, "vectorstores.pkl")
+kb_path = os.path.join(base_dir, "preprocessed_kb.feather")
+faiss_dir = os.path.join(base_dir, "faiss_index")
+faiss_index_file = os.path.join(faiss_dir, "index.faiss")  # written by FAISS.save_local
 
 st.write("Output folder being used:", output_dir)
 
+# Retrieval settings: candidates fetched per query, and the token budget they are packed into
+RETRIEVAL_K = 20
+CONTEXT_TOKEN_BUDGET = 6000
+
+# HNSW graph settings: neighbours per node, build-time and query-time candidate list sizes
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# Chat settings. The system prompt is fixed so every request shares the same cacheable prefix.
+CHAT_MODEL = "gpt-4o-mini"
+SYSTEM_PROMPT = (
+    "You are an assistant answering questions about Novotech SOPs. "
+    "Answer only from the SOP context provided by the user, in a factual and natural tone. "
+    "If the context does not contain the answer, say that you don't know."
+)
+
 # -------------------------------
-# 3️⃣ Load or preprocess KB
+# Loaders (cached ones take the file mtime so edited files are re-read)
 # -------------------------------
-if os.path.exists(kb_pickle):
-    with open(kb_pickle, "rb") as f:
-        kb_data = pickle.load(f)
-    st.info("Loaded preprocessed KB successfully.")
-else:
-    st.info("Preprocessing KB from files...")
+def read_sop_text(path):
+    # Memory-map the file and split once in C; blank lines carry nothing for the splitter
+    if os.path.getsize(path) == 0:
+        return ""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        lines = m[:].decode("utf-8").splitlines()
+    return "\n".join(line for line in lines if line and not line.isspace())
+
+@st.cache_data(show_spinner=False)
+def load_kb(path, mtime):
+    # Stored as a two-column (key, chunk) Arrow table; rebuild the key -> chunks dict
+    table = feather.read_table(path)
+    kb = {}
+    for key, chunk in zip(table.column("key").to_pylist(), table.column("chunk").to_pylist()):
+        kb.setdefault(key, []).append(chunk)
+    return kb
+
+def save_kb(path, kb):
+    keys = [key for key, chunks in kb.items() for _ in chunks]
+    chunks = [chunk for chunks in kb.values() for chunk in chunks]
+    feather.write_feather(pa.table({"key": keys, "chunk": chunks}), path)
+
+@st.cache_resource(show_spinner=False)
+def load_vectorstore(path, mtime, _embeddings):
+    # The index and its docstore were written by this app, so loading them is trusted
+    store = FAISS.load_local(path, _embeddings, allow_dangerous_deserialization=True)
+    if isinstance(store.index, faiss.IndexHNSWFlat):
+        store.index.hnsw.efSearch = HNSW_EF_SEARCH  # not persisted with the index
+    return store
+
+@st.cache_resource(show_spinner=False)
+def source_positions(mtime, _store):
+    # Index positions of every source's chunks, from one pass over the docstore
+    positions = {}
+    for pos, doc_id in _store.index_to_docstore_id.items():
+        positions.setdefault(_store.docstore.search(doc_id).metadata.get("source"), []).append(pos)
+    return positions
+
+@st.cache_resource(show_spinner=False)
+def load_role_vectorstore(role, mtime, _store, _embeddings):
+    # Small flat index over one source's chunks, cut from the global index (vectors reused, no re-embedding)
+    positions = source_positions(mtime, _store).get(role)
+    if not positions:
+        return None
+    docs = [_store.docstore.search(_store.index_to_docstore_id[pos]) for pos in positions]
+    return FAISS.from_embeddings(
+        [(doc.page_content, _store.index.reconstruct(pos).tolist()) for doc, pos in zip(docs, positions)],
+        _embeddings,
+        metadatas=[doc.metadata for doc in docs],
+    )
+
+def build_vectorstore(chunks, vectors, metadatas, embeddings):
+    # HNSW graph instead of the default flat index: approximate, sub-linear search per query
+    index = faiss.IndexHNSWFlat(len(vectors[0]), HNSW_M)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    store = FAISS(embeddings, index, InMemoryDocstore({}), {})
+    store.add_embeddings(list(zip(chunks, vectors)), metadatas=metadatas)
+    return store
+
+@st.cache_resource(show_spinner=False)
+def get_openai_client():
+    return OpenAI()  # requires OPENAI_API_KEY in Codespaces
+
+@st.cache_resource(show_spinner=False)
+def get_embeddings():
+    # chunk_size = texts sent per embeddings request
+    return OpenAIEmbeddings(chunk_size=1000)
+
+@st.cache_resource(show_spinner=False)
+def get_splitter():
+    # Token-aware chunks sized for the embedding model (cl100k_base tokenizer)
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name="cl100k_base", chunk_size=400, chunk_overlap=40
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_token_encoder():
+    return tiktoken.get_encoding("cl100k_base")
+
+def normalize_chunk(text):
+    # Case- and whitespace-insensitive form used to spot repeated chunks
+    return " ".join(text.lower().split())
+
+def pick_within_budget(docs, budget):
+    """Keep retrieved chunks in relevance order until the token budget would be exceeded."""
+    # Token counts for all candidates in one batched (multi-threaded Rust) call
+    counts = [len(tokens) for tokens in get_token_encoder().encode_batch([doc.page_content for doc in docs])]
+    picked = []
+    used = 0
+    for doc, n in zip(docs, counts):
+        if used + n > budget:
+            break
+        picked.append(doc)
+        used += n
+    return picked
+
+@st.cache_data(ttl=60, show_spinner=False)
+def dir_fingerprint(path):
+    # One hash over (name, mtime) of every file: unchanged folder -> same key -> cached build reused
+    entries = sorted((f, os.path.getmtime(os.path.join(path, f))) for f in os.listdir(path))
+    return hashlib.blake2b(repr(entries).encode(), digest_size=16).hexdigest()
+
+@st.cache_data(show_spinner=False)
+def build_kb(output_dir, fingerprint):
+    """Split every role .txt file and every .xlsx sheet in output_dir into chunks, keyed by source."""
     kb_data = {}
-    
-    for file in os.listdir(output_dir):
-        file_path = os.path.join(output_dir, file)
+    splitter = get_splitter()
+    files = os.listdir(output_dir)
+
+    # Read the role text files and parse the workbooks (all sheets per read) concurrently, keeping directory order
+    txt_files = [file for file in files if file.endswith(".txt")]
+    xlsx_files = [file for file in files if file.endswith(".xlsx")]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        texts = pool.map(read_sop_text, [os.path.join(output_dir, f) for f in txt_files])
+        workbooks = pool.map(lambda f: pd.read_excel(os.path.join(output_dir, f), sheet_name=None, engine="calamine"), xlsx_files)
+        texts = dict(zip(txt_files, texts))
+        workbooks = dict(zip(xlsx_files, workbooks))
+
+    for file in files:
         if file.endswith(".txt"):
-            with open(file_path, "r") as f:
-                text = f.read()
             # split into chunks
-            splitter = CharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-            kb_data[file] = splitter.split_text(text)
+            kb_data[file] = splitter.split_text(texts[file])
         elif file.endswith(".xlsx"):
-            xls = pd.ExcelFile(file_path)
-            for sheet in xls.sheet_names:
-                df = xls.parse(sheet)
-                text = "\n".join(df.astype(str).values.flatten())
-                splitter = CharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+            for sheet, df in workbooks[file].items():
+                # One C-level serialisation pass: a line per row, cells separated by "|"
+                text = df.to_csv(sep="|", header=False, index=False, na_rep="", lineterminator="\n").rstrip("\n")
                 kb_data[f"{file}-{sheet}"] = splitter.split_text(text)
-    
-    with open(kb_pickle, "wb") as f:
-        pickle.dump(kb_data, f)
+    return kb_data
+
+# -------------------------------
+# 3️⃣ Load or preprocess KB
+# -------------------------------
+if os.path.exists(kb_path):
+    kb_data = load_kb(kb_path, os.path.getmtime(kb_path))
+    st.info("Loaded preprocessed KB successfully.")
+else:
+    st.info("Preprocessing KB from files...")
+    kb_data = build_kb(output_dir, dir_fingerprint(output_dir))
+    save_kb(kb_path, kb_data)
     st.success("KB preprocessing completed and saved.")
 
 # -------------------------------
 # 4️⃣ Create or load embeddings
 # -------------------------------
-if os.path.exists(embeddings_pickle):
-    with open(embeddings_pickle, "rb") as f:
-        vectorstores = pickle.load(f)
+embeddings = get_embeddings()  # requires OPENAI_API_KEY in Codespaces
+
+if os.path.exists(faiss_index_file):
+    vectorstore = load_vectorstore(faiss_dir, os.path.getmtime(faiss_index_file), embeddings)
     st.info("Loaded vectorstore embeddings successfully.")
 else:
     st.info("Creating embeddings for KB...")
-    embeddings = OpenAIEmbeddings()  # requires OPENAI_API_KEY in Codespaces
-    vectorstores = {}
+    # One index over every chunk; the "source" metadata lets role queries filter it.
+    # Repeated chunks (same text up to case/whitespace) are indexed once per source, and
+    # boilerplate shared across sources is embedded once and its vector reused.
+    all_chunks = []
+    all_metadatas = []
+    seen = set()
     for key, chunks in kb_data.items():
-        vectorstores[key] = FAISS.from_texts(chunks, embeddings)
-    with open(embeddings_pickle, "wb") as f:
-        pickle.dump(vectorstores, f)
+        for chunk in chunks:
+            norm = normalize_chunk(chunk)
+            if (key, norm) in seen:
+                continue
+            seen.add((key, norm))
+            all_chunks.append(chunk)
+            all_metadatas.append({"source": key})
+    # Embed each distinct text in a few large batched requests, then index the precomputed vectors
+    norms = [normalize_chunk(c) for c in all_chunks]
+    unique_norms = list(dict.fromkeys(norms))
+    first_text = {}
+    for chunk, norm in zip(all_chunks, norms):
+        first_text.setdefault(norm, chunk)
+    vector_by_norm = dict(zip(unique_norms, embeddings.embed_documents([first_text[n] for n in unique_norms])))
+    vectors = [vector_by_norm[n] for n in norms]
+    vectorstore = build_vectorstore(all_chunks, vectors, all_metadatas, embeddings)
+    vectorstore.save_local(faiss_dir)
     st.success("Embeddings created and saved.")
 
 # -------------------------------
 # 5️⃣ User selects role and queries SOPs
 # -------------------------------
-roles = list(vectorstores.keys())
+roles = list(kb_data.keys())
 selected_role = st.selectbox("Select a role (optional, 'All' searches all SOPs):", ["All"] + roles)
 query = st.text_input("Ask a question about SOPs:")
 
 if query:
-    # create retriever
+    # create retriever: the global index, or the role's own cached sub-index
     if selected_role == "All":
-        all_indices = list(vectorstores.values())
-        combined = FAISS.merge_from(all_indices)
-        retriever = combined.as_retriever()
+        store = vectorstore
     else:
-        retriever = vectorstores[selected_role].as_retriever()
+        store = load_role_vectorstore(selected_role, os.path.getmtime(faiss_index_file), vectorstore, embeddings)
+    retriever = store.as_retriever(search_kwargs={"k": RETRIEVAL_K}) if store is not None else None
+
+    # Most relevant chunks first, cut at the token budget rather than a fixed chunk count
+    docs = retriever.get_relevant_documents(query) if retriever is not None else []
+    context_docs = pick_within_budget(docs, CONTEXT_TOKEN_BUDGET)
     
     # -------------------------------
-    # 6️⃣ Connect retriever to LLM using RetrievalQA
+    # 6️⃣ Answer from the selected chunks
     # -------------------------------
-    qa_chain = RetrievalQA.from_chain_type(
-        llm=ChatOpenAI(temperature=0.2),  # factual, natural answers
-        chain_type="stuff",
-        retriever=retriever,
-        return_source_documents=False
+    # Order chunks by source (not by rank) so the same chunk set always yields byte-identical context
+    context = "\n\n".join(
+        doc.page_content
+        for doc in sorted(context_docs, key=lambda d: (d.metadata.get("source", ""), d.page_content))
+    )
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"SOP CONTEXT:\n{context}"},
+        {"role": "user", "content": f"Question: {query}"},
+    ]
+    stream = get_openai_client().chat.completions.create(
+        model=CHAT_MODEL,
+        temperature=0.2,  # factual, natural answers
+        messages=messages,
+        stream=True,
     )
 
-    response = qa_chain.run(query)
+    # Render tokens as they arrive instead of waiting for the whole completion
     st.markdown("**Agentic AI says:**")
-    st.write(response)
+    placeholder = st.empty()
+    parts = []
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            placeholder.markdown("".join(parts))
 
     # Optional: debug retrieved chunks
-    # docs = retriever.get_relevant_documents(query)
-    # st.write("Top retrieved chunks for debug:")
-    # for doc in docs[:3]:
+    # st.write(f"Chunks in context: {len(context_docs)} of {len(docs)} retrieved")
+    # for doc in context_docs[:3]:
     #     st.write(doc.page_content)
@@ -2,6 +2,14 @@ import os
 import io
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+from sop_matrix import (
+    excel_file_path, HEADER_GROUP_ROW, HEADER_COLS_ROW, DATA_START_ROW, category_map,
+    list_sheets, load_sheet, fill_group_row, role_code_matrix, role_postings, build_groups_map,
+    region_hits, region_labels,
+)
 
 # -------------------------------
 # Streamlit Setup
@@ -12,36 +20,16 @@ st.title("Novotech SOP Matrix")
 # -------------------------------
 # Path to master Excel file
 # -------------------------------
-base_dir = os.path.dirname(__file__)
-excel_file_path = os.path.join(base_dir, "data", "Novotech_SOP_Matrix.xlsx")
-
 if not os.path.exists(excel_file_path):
     st.error(f"Master Excel file not found at {excel_file_path}")
     st.stop()
 
 st.write(f"Using master Excel file: {excel_file_path}")
 
-# -------------------------------
-# Settings: header rows (0-indexed)
-# Based on your description:
-# - Group names row is HEADER_GROUP_ROW
-# - Column headers (Business Unit, SOP Type, Number, Title, Roles...) are in HEADER_COLS_ROW
-# - Data starts at DATA_START_ROW
-HEADER_GROUP_ROW = 0
-HEADER_COLS_ROW = 2
-DATA_START_ROW = 3  # zero-indexed (Excel row 4)
-
-category_map = {
-    "Within 2 weeks": 1,    # All staff SOPs
-    "Within 90 days": 2,    # Role-based SOPs
-    "Before task": 3        # Optional: before a particular task
-}
-
 # -------------------------------
 # Helper functions
-def pick_column(df, candidates):
+def pick_column(cols_lower, candidates):
     """Return the first matching column name from candidates (case-insensitive)."""
-    cols_lower = {c.lower(): c for c in df.columns}
     for cand in candidates:
         if cand is None:
             continue
@@ -50,39 +38,86 @@ def pick_column(df, candidates):
             return cols_lower[key]
     return None
 
-def to_int_safe(v):
-    try:
-        if pd.isna(v):
-            return None
-        if isinstance(v, str):
-            v2 = v.strip()
-            if v2 == "":
-                return None
-            return int(float(v2))
-        return int(v)
-    except Exception:
-        return None
+@st.cache_data(show_spinner=False)
+def resolve_columns(header):
+    """Map the standard fields to this sheet's header names, once per header layout."""
+    cols_lower = {c.lower(): c for c in header}
+    title_col = pick_column(cols_lower, ["Title", "SOP Title", "Name", "Title "])
+    # Fallback: if title_col missing, try column D (4th column name)
+    if title_col is None and len(header) >= 4:
+        title_col = header[3]
+    return {
+        "bu": pick_column(cols_lower, ["Business Unit", "BusinessUnit", "Business unit", "Business_unit"]),
+        "sop_type": pick_column(cols_lower, ["SOP Type", "SOPType", "SOP type"]),
+        "number": pick_column(cols_lower, ["Number", "No", "ID", "SOP Number", "SOP No", "Number "]),
+        "title": title_col,
+        "notes": pick_column(cols_lower, ["Notes", "Note", "Remarks", "Region Notes", "Comments"]),
+    }
+
+# Bump whenever parse_role_codes / role_code_matrix change what they produce (invalidates the Parquet copies)
+ROLE_CODES_VERSION = 2
+
+@st.cache_data(show_spinner=False)
+def parse_role_codes(_data_df, path, sheet_name, mtime):
+    """Role codes of every role column (E onward) as nullable Int8; blanks and marks like "2;3" become <NA>.
+
+    The result is kept in a Parquet file beside the workbook; the file name carries ROLE_CODES_VERSION and the
+    workbook's mtime and only an exact match is read, so neither a change to the parsing nor a workbook replaced
+    by an older-dated file ever reads another version's codes.
+    """
+    cache_path = f"{path}.{sheet_name}.roles.v{ROLE_CODES_VERSION}.{mtime:.0f}.parquet"
+    if os.path.exists(cache_path):
+        codes_df = pd.read_parquet(cache_path)
+    else:
+        codes = role_code_matrix(_data_df.iloc[:, 4:].to_numpy(dtype=object))
+        codes_df = pd.DataFrame(codes, columns=[str(i) for i in range(codes.shape[1])]).astype("Int8")
+        codes_df = codes_df.mask(codes_df == -1)  # -1 = no usable code
+        try:
+            codes_df.to_parquet(cache_path, index=False)
+        except OSError:
+            pass  # read-only checkout: keep the in-memory copy only
+    codes_df.columns = range(codes_df.shape[1])
+    return codes_df
+
+@st.cache_data(show_spinner=False)
+def build_role_rows(_role_codes, sheet_name, mtime):
+    """(col_idx, category code) -> row positions holding that code, for every role column."""
+    codes = _role_codes.to_numpy(dtype="int8", na_value=-1)
+    return role_postings(codes, range(4, 4 + codes.shape[1]))
+
+@st.cache_data(show_spinner=False)
+def sheet_layout(_raw, sheet_name, mtime):
+    """(header_row, groups_map) from the two header rows alone, once per sheet version."""
+    group_row = fill_group_row(_raw.iloc[HEADER_GROUP_ROW].to_numpy(dtype=object))
+    header_row = _raw.iloc[HEADER_COLS_ROW].astype(str).tolist()
+    # group -> list of (col_idx, role_name), by position to avoid duplicate-label issues
+    return header_row, build_groups_map(group_row, header_row)
+
+@st.cache_data(show_spinner=False)
+def sheet_region_hits(_data_df, notes_col, sheet_name, mtime):
+    """region_hits() of the sheet's notes, scanned once per sheet version."""
+    return region_hits(_data_df[notes_col])
 
 # -------------------------------
 # Load workbook and list sheets
-xls = pd.ExcelFile(excel_file_path)
-sheets = xls.sheet_names
+excel_mtime = os.path.getmtime(excel_file_path)
+sheets = list_sheets(excel_file_path, excel_mtime)
 sheet_choice = st.selectbox("Choose sheet:", sheets)
 
 # Load the selected sheet with no header to access the group row and header row
-raw = pd.read_excel(excel_file_path, sheet_name=sheet_choice, header=None, dtype=object)
+raw = load_sheet(excel_file_path, sheet_choice, excel_mtime)
 
 # Basic sanity checks
 if raw.shape[0] <= HEADER_COLS_ROW:
     st.error("The selected sheet doesn't have the expected header rows. Check the sheet layout.")
     st.stop()
 
-# Extract group row and header (roles) row
-group_row = raw.iloc[HEADER_GROUP_ROW].copy().fillna(method="ffill")
-header_row = raw.iloc[HEADER_COLS_ROW].astype(str).tolist()
+# Header (roles) row and group -> roles mapping, derived from the header rows only
+header_row, groups_map = sheet_layout(raw, sheet_choice, excel_mtime)
 
 # Build data frame with header_row as columns and data starting from DATA_START_ROW
-data_df = raw.iloc[DATA_START_ROW:].copy().reset_index(drop=True)
+# (reset_index already returns a new frame, so no separate copy of the slice)
+data_df = raw.iloc[DATA_START_ROW:].reset_index(drop=True)
 data_df.columns = header_row
 
 # Roles are columns from index 4 (E) onward per your spec
@@ -90,17 +125,6 @@ if len(header_row) <= 4:
     st.error("Unable to detect role columns: sheet doesn't have columns beyond column E.")
     st.stop()
 
-# Build group -> list of (col_idx, role_name) mapping using positions to avoid duplicate-label issues
-groups_map = {}
-for col_idx, col_name in enumerate(header_row):
-    if col_idx < 4:
-        continue
-    raw_group_val = group_row.iloc[col_idx] if col_idx < len(group_row) else ""
-    group_name = str(raw_group_val).strip() if not pd.isna(raw_group_val) else ""
-    if group_name == "" or group_name.lower() in ("nan", "none"):
-        group_name = "Ungrouped"
-    groups_map.setdefault(group_name, []).append((col_idx, col_name))
-
 # Sort groups for UI
 groups_sorted = sorted(groups_map.keys())
 
@@ -132,75 +156,57 @@ st.markdown("---")
 # -------------------------------
 # Normalize expected columns (Number, Title, Business Unit, SOP Type, Notes)
 # Use header names present in data_df (which are header_row entries)
-bu_col = pick_column(data_df, ["Business Unit", "BusinessUnit", "Business unit", "Business_unit"])
-sop_type_col = pick_column(data_df, ["SOP Type", "SOPType", "SOP type"])
-number_col = pick_column(data_df, ["Number", "No", "ID", "SOP Number", "SOP No", "Number "])
-title_col = pick_column(data_df, ["Title", "SOP Title", "Name", "Title "])
-notes_col = pick_column(data_df, ["Notes", "Note", "Remarks", "Region Notes", "Comments"])
-
-# Fallback: if title_col missing, try column D (4th column name)
-if title_col is None and len(data_df.columns) >= 4:
-    title_col = data_df.columns[3]
+cols = resolve_columns(tuple(header_row))
+bu_col = cols["bu"]
+sop_type_col = cols["sop_type"]
+number_col = cols["number"]
+title_col = cols["title"]
+notes_col = cols["notes"]
 
 # -------------------------------
-# Use iloc with selected_col_idx to get the exact role column (avoids duplicate label problem)
-role_series = data_df.iloc[:, selected_col_idx].apply(to_int_safe)
+# Role codes for the whole sheet are parsed and indexed once; columns are keyed by position (avoids duplicate labels)
+role_codes = parse_role_codes(data_df, excel_file_path, sheet_choice, excel_mtime)
+role_rows = build_role_rows(role_codes, sheet_choice, excel_mtime)
 
-# Filter rows where role == category_value
-filtered = data_df[role_series == category_value].copy()
+# Rows where role == category_value
+row_positions = role_rows[(selected_col_idx, category_value)]
 
 # -------------------------------
 # Prepare table to display with Number & Title first
-if filtered.empty:
+if len(row_positions) == 0:
     st.info(f"No SOPs found for role **{selected_role_display}** in category **{sop_category}** (sheet: {sheet_choice}).")
 else:
     # Build display dataframe
-    display_cols = []
-    if number_col and number_col in filtered.columns:
-        display_cols.append(number_col)
-    if title_col and title_col in filtered.columns:
-        display_cols.append(title_col)
-
-    # Add additional useful columns
-    for c in ["Business Unit", "SOP Type", "Notes"]:
-        if c in filtered.columns:
-            display_cols.append(c)
+    # Number, Title, then additional useful columns; one hashed set for the membership tests
+    present = set(data_df.columns)
+    display_cols = [c for c in (number_col, title_col, "Business Unit", "SOP Type", "Notes") if c and c in present]
 
     # If none of number/title detected, fall back to first 4 columns
     if not display_cols:
-        display_cols = list(filtered.columns[:4])
-
-    table_df = filtered[display_cols].copy()
-    # Clean NaNs
-    table_df = table_df.fillna("")
-    # Standardize column names for display: prefer "Number" and "Title"
-    rename_map = {}
-    if number_col and number_col in table_df.columns:
-        rename_map[number_col] = "Number"
-    if title_col and title_col in table_df.columns:
-        rename_map[title_col] = "Title"
-    table_df = table_df.rename(columns=rename_map)
-
-    # Reorder to ensure Number then Title
-    cols_order = []
-    if "Number" in table_df.columns:
-        cols_order.append("Number")
-    if "Title" in table_df.columns:
-        cols_order.append("Title")
-    for c in table_df.columns:
-        if c not in cols_order:
-            cols_order.append(c)
-    table_df = table_df[cols_order]
+        display_cols = list(data_df.columns[:4])
+
+    # Order (Number then Title first) and display names are settled on the labels, so the table
+    # itself is built in one chain: narrow column take, row take, rename, clean NaNs.
+    # Arrow-typed columns go to st.dataframe (and the CSV writer) without a per-cell conversion.
+    cols_order = list(dict.fromkeys([c for c in (number_col, title_col) if c in display_cols] + display_cols))
+    rename_map = {c: name for c, name in ((number_col, "Number"), (title_col, "Title")) if c and c in display_cols}
+    table_df = (
+        data_df[cols_order]
+        .iloc[row_positions]
+        .rename(columns=rename_map)
+        .fillna("")
+        .convert_dtypes(dtype_backend="pyarrow")
+    )
 
     st.subheader(
         f"SOPs — Sheet: **{sheet_choice}** | Group: **{selected_group}** | Role: **{selected_role_display}** | Category: **{sop_category}**"
     )
     st.dataframe(table_df.reset_index(drop=True), use_container_width=True)
 
-    # CSV download
-    csv_buffer = io.StringIO()
-    table_df.to_csv(csv_buffer, index=False)
-    csv_bytes = csv_buffer.getvalue().encode()
+    # CSV download (Arrow's C++ writer straight into bytes, no str -> bytes re-encode)
+    csv_buffer = io.BytesIO()
+    pacsv.write_csv(pa.Table.from_pandas(table_df, preserve_index=False), csv_buffer)
+    csv_bytes = csv_buffer.getvalue()
     st.download_button(
         label="Download filtered SOPs as CSV",
         data=csv_bytes,
@@ -212,26 +218,24 @@ else:
 # Region detection (from Notes) — optional
 st.markdown("---")
 st.write("Region-specific SOPs detected in Notes (simple keyword scan):")
-regions = ["china", "korea", "taiwan", "hong kong", "india", "us", "uk"]  # extend as needed
-
 if notes_col and notes_col in data_df.columns:
-    def detect_regions(text):
-        text = str(text).lower()
-        found = [r for r in regions if r in text]
-        return ", ".join(found) if found else ""
-
-    data_df["RegionsDetected"] = data_df[notes_col].apply(detect_regions)
-    region_hits = data_df[data_df["RegionsDetected"] != ""]
-    if not region_hits.empty:
+    # One regex pass over the notes per sheet version (keyword list lives in sop_matrix.regions); rows with
+    # any hit come straight from the hit matrix, and only those rows get a joined label (data_df is left as is)
+    hits = sheet_region_hits(data_df, notes_col, sheet_choice, excel_mtime)
+    has_region = hits.any(axis=1).to_numpy()
+    region_rows = data_df.loc[has_region, [c for c in [number_col, title_col] if c in data_df.columns]].assign(
+        RegionsDetected=region_labels(hits[has_region])
+    )
+    if not region_rows.empty:
         # prepare display
-        display = region_hits[[c for c in [number_col, title_col, "RegionsDetected"] if c in region_hits.columns]].fillna("")
+        display = region_rows.fillna("")
         rename_map2 = {}
         if number_col and number_col in display.columns:
             rename_map2[number_col] = "Number"
         if title_col and title_col in display.columns:
             rename_map2[title_col] = "Title"
         display = display.rename(columns=rename_map2)
-        st.dataframe(display.reset_index(drop=True), use_container_width=True)
+        st.dataframe(display.reset_index(drop=True).convert_dtypes(dtype_backend="pyarrow"), use_container_width=True)
     else:
         st.write("No region-specific indicators found.")
 else:
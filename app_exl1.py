@@ -2,6 +2,13 @@ import os
 import io
 import streamlit as st
 import pandas as pd
+import numpy as np
+
+from sop_matrix import (
+    excel_file_path, HEADER_GROUP_ROW, HEADER_COLS_ROW, DATA_START_ROW, category_map,
+    load_first_sheet, fill_group_row, role_code_matrix, role_postings, build_groups_map,
+    detect_regions,
+)
 
 # -------------------------------
 # Streamlit Setup
@@ -12,113 +19,165 @@ st.title("Novotech SOP Matrix")
 # -------------------------------
 # Path to master Excel file
 # -------------------------------
-base_dir = os.path.dirname(__file__)
-excel_file_path = os.path.join(base_dir, "data", "Novotech_SOP_Matrix.xlsx")
-
 if not os.path.exists(excel_file_path):
     st.error(f"Master Excel file not found at {excel_file_path}")
     st.stop()
 
-# -------------------------------
-# Settings
-# -------------------------------
-HEADER_GROUP_ROW = 0
-HEADER_COLS_ROW = 2
-DATA_START_ROW = 3
-
-category_map = {
-    "Within 2 weeks": 1,
-    "Within 90 days": 2,
-    "Before task": 3
-}
-
-regions = ["china", "korea", "taiwan", "hong kong", "india", "us", "uk"]
-
 # -------------------------------
 # Helper functions
 # -------------------------------
-def pick_column(df, candidates):
-    cols_lower = {c.lower(): c for c in df.columns}
+def pick_column(cols_lower, candidates):
     for cand in candidates:
         if cand and cand.lower() in cols_lower:
             return cols_lower[cand.lower()]
     return None
 
-def to_int_safe(v):
-    try:
-        if pd.isna(v):
-            return None
-        if isinstance(v, str):
-            v2 = v.strip()
-            if v2 == "":
-                return None
-            return int(float(v2))
-        return int(v)
-    except Exception:
+def resolve_columns(header_row):
+    """Map the standard fields to this sheet's header names (None when absent)."""
+    cols_lower = {c.lower(): c for c in header_row}
+    cols = {
+        "practice": pick_column(cols_lower, ["Practice", "Department", "Function"]),
+        "group": pick_column(cols_lower, ["Group", "SOP Group", "Team Group"]),
+        "bu": pick_column(cols_lower, ["Business Unit", "BusinessUnit"]),
+        "sop_type": pick_column(cols_lower, ["SOP Type", "Type"]),
+        "number": pick_column(cols_lower, ["Number", "SOP Number", "No", "ID"]),
+        "title": pick_column(cols_lower, ["Title", "SOP Title"]),
+        "notes": pick_column(cols_lower, ["Notes", "Remarks", "Comments", "Region Notes"]),
+    }
+    if cols["title"] is None and len(header_row) >= 4:
+        cols["title"] = header_row[3]
+    return cols
+
+@st.cache_data(show_spinner=False)
+def load_matrix(path, mtime):
+    """Parse the first sheet once per workbook version into (sheet_name, header_row, data_df, groups_map, cols).
+
+    Returns None when the workbook has no sheets or the sheet doesn't have the expected header rows.
+    """
+    # Shared loader: the first sheet's Parquet copy for this workbook version, else the first sheet of the
+    # single cached workbook read; its name comes with it, so there is no separate workbook open to list sheets
+    first_sheet = load_first_sheet(path, mtime)
+    if first_sheet is None:
+        return None
+    sheet_name, raw = first_sheet
+    if raw.shape[0] <= HEADER_COLS_ROW:
         return None
 
-def detect_regions(text):
-    text = str(text).lower()
-    found = [r for r in regions if r in text]
-    return ", ".join(found) if found else ""
+    group_row = fill_group_row(raw.iloc[HEADER_GROUP_ROW].to_numpy(dtype=object))
+    header_row = raw.iloc[HEADER_COLS_ROW].astype(str).tolist()
+    cols = resolve_columns(header_row)
+    # Cells are already Arrow strings; role columns are parsed by build_role_index (they hold marks like "2;3" too).
+    meta = raw.iloc[DATA_START_ROW:, :4]
+    # Business Unit and SOP Type repeat a handful of values: categoricals store integer codes, one copy per value
+    for j, name in enumerate(header_row[:4]):
+        if name in (cols["bu"], cols["sop_type"]):
+            meta[meta.columns[j]] = meta.iloc[:, j].astype("category")
+    data_df = pd.concat([meta, raw.iloc[DATA_START_ROW:, 4:]], axis=1).reset_index(drop=True)
+    data_df.columns = header_row
+
+    # Build group -> list of (col_idx, role_name)
+    groups_map = build_groups_map(group_row, header_row)
+
+    return sheet_name, header_row, data_df, groups_map, cols
+
+@st.cache_data(show_spinner=False)
+def role_lookups(_groups_map, sheet_name, mtime):
+    """Role column arrays and dropdown labels derived from groups_map, once per sheet version."""
+    # Every role column (ascending) with its header group, for vectorized group filtering
+    col_to_group = {col_idx: g for g, entries in _groups_map.items() for col_idx, _ in entries}
+    role_cols = np.array(sorted(col_to_group), dtype=np.intp)
+    role_col_groups = np.array([col_to_group[c] for c in role_cols], dtype=object)
+    # Role dropdown label -> column index (labels are unique per column)
+    role_label_to_col = {
+        f"{role_name} (col {col_idx})": col_idx
+        for entries in _groups_map.values()
+        for col_idx, role_name in entries
+    }
+    label_to_group = {label: col_to_group[col_idx] for label, col_idx in role_label_to_col.items()}
+    role_labels_sorted = sorted(role_label_to_col, key=str.lower)
+    return role_cols, role_col_groups, role_label_to_col, label_to_group, role_labels_sorted
+
+@st.cache_data(show_spinner=False)
+def build_role_index(_data_df, role_col_indices, sheet_name, mtime):
+    """Inverted index: (col_idx, category code) -> sorted row positions holding that code."""
+    # Dense int8 row x role matrix, parsed once per sheet version (-1 = blank or marks like "2;3")
+    role_matrix = role_code_matrix(_data_df.iloc[:, list(role_col_indices)].to_numpy(dtype=object))
+    return role_postings(role_matrix, role_col_indices)
+
+def rows_from_postings(parts, n_rows):
+    """Union of posting lists, in sheet order: scatter into one bool mask, no sort."""
+    mask = np.zeros(n_rows, dtype=bool)
+    for rows in parts:
+        mask[rows] = True
+    return np.flatnonzero(mask)
+
+def lookup_rows(role_index, col_indices, codes, n_rows):
+    """Union of the posting lists for every (column, code) pair, in sheet order."""
+    return rows_from_postings(
+        (role_index[(c, v)] for c in col_indices for v in codes if (c, v) in role_index), n_rows
+    )
+
+@st.cache_data(show_spinner=False)
+def assigned_rows(_role_index, n_rows, sheet_name, mtime):
+    """Rows holding any category code in any role column: the unfiltered result."""
+    return rows_from_postings(_role_index.values(), n_rows)
+
+@st.cache_data(show_spinner=False)
+def sheet_regions(_data_df, notes_col, sheet_name, mtime):
+    """RegionsDetected for every row of the sheet, by row position; scanned once per workbook version."""
+    if not notes_col:
+        return np.full(len(_data_df), "", dtype=object)
+    return detect_regions(_data_df[notes_col]).to_numpy(dtype=object)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def table_csv(_table_df, sheet_name, mtime, cols_to_search, codes):
+    """CSV bytes of the results table, serialised once per filter selection."""
+    csv_buffer = io.BytesIO()
+    _table_df.to_csv(csv_buffer, index=False, na_rep="", encoding="utf-8")  # blanks for missing cells
+    return csv_buffer.getvalue()
 
 # -------------------------------
 # Load workbook (auto first sheet)
 # -------------------------------
-xls = pd.ExcelFile(excel_file_path)
-sheets = xls.sheet_names
-if not sheets:
-    st.error("No sheets found in the Excel file.")
+excel_mtime = os.path.getmtime(excel_file_path)
+matrix = load_matrix(excel_file_path, excel_mtime)
+if matrix is None:
+    st.error("No sheets found in the Excel file, or the first sheet doesn't have the expected header rows.")
     st.stop()
-
-sheet_choice = sheets[0]
+sheet_choice, header_row, data_df, groups_map, cols = matrix
 st.markdown(f"**Using sheet:** {sheet_choice}")
 
-raw = pd.read_excel(excel_file_path, sheet_name=sheet_choice, header=None, dtype=object)
-if raw.shape[0] <= HEADER_COLS_ROW:
-    st.error("The sheet doesn't have the expected header rows.")
-    st.stop()
-
-group_row = raw.iloc[HEADER_GROUP_ROW].copy().fillna(method="ffill")
-header_row = raw.iloc[HEADER_COLS_ROW].astype(str).tolist()
-data_df = raw.iloc[DATA_START_ROW:].copy().reset_index(drop=True)
-data_df.columns = header_row
-
 if len(header_row) <= 4:
     st.error("Unable to detect role columns beyond column E.")
     st.stop()
 
-# Build group -> list of (col_idx, role_name)
-groups_map = {}
-for col_idx, col_name in enumerate(header_row):
-    if col_idx < 4:
-        continue
-    raw_group_val = group_row.iloc[col_idx] if col_idx < len(group_row) else ""
-    group_name = str(raw_group_val).strip() if not pd.isna(raw_group_val) else ""
-    if group_name == "" or group_name.lower() in ("nan", "none"):
-        group_name = "Ungrouped"
-    groups_map.setdefault(group_name, []).append((col_idx, col_name))
-
 # Alphabetical group list
 groups_sorted = sorted(groups_map.keys(), key=lambda x: x.lower())
 
-# Identify common columns
-practice_col = pick_column(data_df, ["Practice", "Department", "Function"])
-group_col = pick_column(data_df, ["Group", "SOP Group", "Team Group"])
-bu_col = pick_column(data_df, ["Business Unit", "BusinessUnit"])
-sop_type_col = pick_column(data_df, ["SOP Type", "Type"])
-number_col = pick_column(data_df, ["Number", "SOP Number", "No", "ID"])
-title_col = pick_column(data_df, ["Title", "SOP Title"])
-notes_col = pick_column(data_df, ["Notes", "Remarks", "Comments", "Region Notes"])
-
-if title_col is None and len(data_df.columns) >= 4:
-    title_col = data_df.columns[3]
-
-# Precompute RegionsDetected
-if notes_col:
-    data_df["RegionsDetected"] = data_df[notes_col].apply(detect_regions)
-else:
-    data_df["RegionsDetected"] = ""
+# Role columns and dropdown labels (cached per sheet version)
+role_cols, role_col_groups, role_label_to_col, label_to_group, role_labels_sorted = role_lookups(
+    groups_map, sheet_choice, excel_mtime
+)
+
+# Common columns, resolved once per sheet version by load_matrix
+practice_col = cols["practice"]
+group_col = cols["group"]
+bu_col = cols["bu"]
+sop_type_col = cols["sop_type"]
+number_col = cols["number"]
+title_col = cols["title"]
+notes_col = cols["notes"]
+
+# Display column list (depends only on the sheet header); Business Unit is shown as SOP Owner below
+display_cols = []
+for c in [number_col, title_col, practice_col, group_col, bu_col, sop_type_col, "RegionsDetected", notes_col]:
+    if c and (c in data_df.columns or c == "RegionsDetected") and c not in display_cols:
+        display_cols.append(c)
+
+# Row index per (role column, category code); filters below only touch matching rows
+role_index = build_role_index(
+    data_df, tuple(range(4, len(header_row))), sheet_choice, excel_mtime
+)
 
 # -------------------------------
 # Layout: left = filters, right = main
@@ -129,51 +188,31 @@ left_col, right_col = st.columns([1, 3])
 with left_col:
     st.header("Filters")
 
-    st.markdown("**Group** (header groups) — unchecked by default")
-    selected_groups = []
-    for i, g in enumerate(groups_sorted):
-        key = f"filter_group__{i}"
-        # default unchecked
-        checked = st.checkbox(g, value=False, key=key)
-        if checked:
-            selected_groups.append(g)
+    # One multiselect per filter (not a checkbox per value), inside a form so picking
+    # several values costs one rerun (on Apply), not one per click
+    with st.form("filters"):
+        # empty by default
+        selected_groups = st.multiselect("Group (header groups)", groups_sorted, default=[], key="filter_groups")
+        st.markdown("---")
+        selected_categories = st.multiselect("Category", list(category_map.keys()), default=[], key="filter_cats")
 
-    st.markdown("---")
-    st.markdown("**Category** — unchecked by default")
-    selected_categories = []
-    cat_keys = list(category_map.keys())
-    for i, c in enumerate(cat_keys):
-        key = f"filter_cat__{i}"
-        checked = st.checkbox(c, value=False, key=key)
-        if checked:
-            selected_categories.append(c)
+        st.form_submit_button("Apply filters")
 
     st.markdown("---")
-    st.write("Tip: leave all checkboxes unchecked to include all Groups / Categories.")
+    st.write("Tip: leave a filter empty to include all Groups / Categories.")
 
 # RIGHT: role selector (reflects left-group filter) + results
 with right_col:
-    # Determine which groups to use for role list:
-    # If none selected on left, use all groups; otherwise use the checked groups
-    groups_for_roles = selected_groups if selected_groups else groups_sorted
-
-    # Build list of role display strings from those groups (unique, sorted)
-    role_items = []
-    for g in groups_for_roles:
-        for col_idx, role_name in groups_map.get(g, []):
-            role_label = f"{role_name} (col {col_idx})"
-            role_items.append((role_label, col_idx, g, role_name))
-    # dedupe by label (in case) and sort by role label
-    seen = set()
-    role_items_unique = []
-    for label, col_idx, g, role_name in role_items:
-        if label not in seen:
-            seen.add(label)
-            role_items_unique.append((label, col_idx, g, role_name))
-    role_items_unique.sort(key=lambda x: x[0].lower())
-
-    # Build dropdown options: include "All roles" first
-    role_options = ["All roles"] + [label for label, _, _, _ in role_items_unique]
+    # A filter with nothing (or everything) selected narrows nothing; skip its lookups entirely
+    filter_groups = 0 < len(selected_groups) < len(groups_sorted)
+    filter_categories = 0 < len(selected_categories) < len(category_map)
+
+    # Role display strings (already unique and sorted) from the selected groups, or all of them; "All roles" first
+    if filter_groups:
+        groups_for_roles = set(selected_groups)
+        role_options = ["All roles"] + [label for label in role_labels_sorted if label_to_group[label] in groups_for_roles]
+    else:
+        role_options = ["All roles"] + role_labels_sorted
 
     if len(role_options) == 1:
         st.warning("No roles found for the selected group(s).")
@@ -181,62 +220,47 @@ with right_col:
         selected_col_idx = None
     else:
         selected_role_display = st.selectbox("Choose the Role (optional):", role_options)
-        selected_col_idx = None if selected_role_display == "All roles" else next(
-            (col_idx for label, col_idx, _, _ in role_items_unique if label == selected_role_display), None
-        )
+        selected_col_idx = role_label_to_col.get(selected_role_display)  # None for "All roles"
 
     st.markdown("---")
 
-    # Determine allowed column indices from selected groups (OR across groups)
-    groups_allowed = selected_groups if selected_groups else groups_sorted
-    allowed_cols = []
-    for g in groups_allowed:
-        allowed_cols += [col_idx for col_idx, _ in groups_map.get(g, [])]
-    allowed_cols = sorted(set(allowed_cols))
-
     # Determine allowed category codes (OR across categories)
-    if selected_categories:
+    if filter_categories:
         allowed_codes = [category_map[c] for c in selected_categories if c in category_map]
     else:
         allowed_codes = list(category_map.values())
 
-    # Build mask:
-    # If user selected a specific role (selected_col_idx not None), restrict to that column only.
+    # Columns to search:
+    # A specific role searches its own column only, provided its group is allowed (a dict lookup,
+    # no list of allowed columns is built); "All roles" searches every column of the allowed groups
+    # (OR across groups, one np.isin over the role columns' group labels).
     if selected_col_idx is not None:
-        # role-specific filtering: check that selected_col_idx is in allowed_cols; if not, no rows
-        if selected_col_idx not in allowed_cols:
-            mask = pd.Series(False, index=data_df.index)
-        else:
-            mask = data_df.iloc[:, selected_col_idx].apply(to_int_safe).isin(allowed_codes)
+        role_allowed = not filter_groups or label_to_group[selected_role_display] in selected_groups
+        cols_to_search = [selected_col_idx] if role_allowed else []
+    elif filter_groups:
+        cols_to_search = role_cols[np.isin(role_col_groups, selected_groups)].tolist()
     else:
-        # "All roles" — build a DataFrame of allowed columns and check any match in allowed_codes
-        if not allowed_cols:
-            mask = pd.Series(False, index=data_df.index)
-        else:
-            allowed_vals_df = data_df.iloc[:, allowed_cols].applymap(to_int_safe)
-            mask = allowed_vals_df.isin(allowed_codes).any(axis=1)
+        cols_to_search = role_cols.tolist()
 
-    filtered = data_df[mask].copy()
+    # Look up matching rows
+    if not filter_groups and not filter_categories and selected_col_idx is None:
+        # No filter active: every row assigned to any role, merged once per sheet version
+        row_positions = assigned_rows(role_index, len(data_df), sheet_choice, excel_mtime)
+    else:
+        row_positions = lookup_rows(role_index, cols_to_search, allowed_codes, len(data_df))
 
     # Display results
-    if filtered.empty:
+    if len(row_positions) == 0:
         st.info("No SOPs found for the current Group(s)/Category/Role selection.")
     else:
-        # Build display column list; replace Business Unit header with SOP Owner if present
-        display_cols = []
-        if number_col and number_col in filtered.columns:
-            display_cols.append(number_col)
-        if title_col and title_col in filtered.columns:
-            display_cols.append(title_col)
-
-        for c in [practice_col, group_col, bu_col, sop_type_col, "RegionsDetected", notes_col]:
-            if c and c in filtered.columns and c not in display_cols:
-                display_cols.append(c)
-
-        if not display_cols:
-            display_cols = list(filtered.columns[:6])
-
-        table_df = filtered[display_cols].fillna("")
+        # Take only the displayed columns of the matching rows (no copy of the whole matrix);
+        # regions are scanned once per sheet version, so reruns only gather the matching rows
+        table_df = (
+            data_df[[c for c in display_cols if c != "RegionsDetected"]]
+            .iloc[row_positions]
+            .assign(RegionsDetected=sheet_regions(data_df, notes_col, sheet_choice, excel_mtime)[row_positions])
+            [display_cols]
+        )
 
         # Rename columns for display; Business Unit -> SOP Owner
         rename_map = {}
@@ -269,14 +293,15 @@ with right_col:
         table_df = table_df[cols_order]
 
         st.subheader(f"SOPs — Sheet: {sheet_choice}")
-        st.dataframe(table_df.reset_index(drop=True), use_container_width=True)
+        # Missing cells render blank, as before; only the displayed copy is filled (categoricals as plain strings)
+        st.dataframe(
+            table_df.reset_index(drop=True).astype("string[pyarrow]").fillna(""), use_container_width=True
+        )
 
-        # CSV download
-        csv_buffer = io.StringIO()
-        table_df.to_csv(csv_buffer, index=False)
+        # CSV download; the table is fully determined by the searched columns and codes, so key on those
         st.download_button(
             label="Download filtered SOPs as CSV",
-            data=csv_buffer.getvalue().encode(),
+            data=table_csv(table_df, sheet_choice, excel_mtime, tuple(cols_to_search), tuple(allowed_codes)),
             file_name=f"sops_filtered_{sheet_choice}.csv",
             mime="text/csv",
         )
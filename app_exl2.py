@@ -2,9 +2,17 @@
 import re
 import io
 import os
-from typing import List, Set
+import sys
+import json
+from types import MappingProxyType
+from typing import List
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 
 st.set_page_config(page_title="Novotech Functional Training", layout="wide")
 st.title("Novotech Functional Training")
@@ -21,312 +29,425 @@ st.write(f"Reading Excel from: {EXCEL_PATH}")
 # -------------------------
 # Parsing helpers for Column B (more tolerant)
 # -------------------------
-# match Role or Roles : Any of : ( ... )
-ROLE_RE = re.compile(r"Role(?:s)?\s*:\s*Any of\s*:\s*\(([^)]*)\)", flags=re.I)
+# One pass per cell: Role or Roles : Any of : ( ... ), or Organisation / Organisation Type : Any of : ( ... ).
+# The named group that matched says which list the items belong to.
+CELL_RE = re.compile(
+    r"Role(?:s)?\s*:\s*Any of\s*:\s*\((?P<roles>[^)]*)\)"
+    r"|Organisat(?:ion|ion)\s*(?:Type)?\s*:\s*Any of\s*:\s*\((?P<orgs>[^)]*)\)",
+    flags=re.I,
+)
+GROUP_WORD_RE = re.compile(r"\bgroup\b", flags=re.I)
+GROUP_SUFFIX_RE = re.compile(r"\(?\s*group\s*\)?", flags=re.I)
+PRACTICE_WORD_RE = re.compile(r"\bpractice\b", flags=re.I)
+PRACTICE_SUFFIX_RE = re.compile(r"\(?\s*practice\s*\)?", flags=re.I)
+EDGE_RE = re.compile(r"^[\(\)\s\"']+|[\(\)\s\"']+$")
+SPACES_RE = re.compile(r"\s{2,}")
 
-# match Organisation or Organisation Type or Organization etc.
-ORG_RE = re.compile(r"Organisat(?:ion|ion)\s*(?:Type)?\s*:\s*Any of\s*:\s*\(([^)]*)\)", flags=re.I)
+def split_items(matches: pd.Series) -> pd.Series:
+    """Comma-separated items of every match, one per row (index kept), trimmed and without blanks."""
+    # commas inside parentheses not expected; strip also drops the space after each comma
+    items = matches.dropna().str.split(",").explode().str.strip()
+    return items[items != ""]
 
-def split_items(s: str) -> List[str]:
-    if not isinstance(s, str) or s.strip() == "":
-        return []
-    # split on comma but allow commas inside parentheses not expected — simple split
-    parts = [p.strip() for p in re.split(r",\s*", s) if p is not None]
-    parts = [p for p in parts if p != ""]
-    return parts
-
-def clean_item(it: str) -> str:
-    if not isinstance(it, str):
-        return ""
-    # remove surrounding parentheses and stray quotes and whitespace
-    it2 = re.sub(r"^[\(\)\s\"']+|[\(\)\s\"']+$", "", it).strip()
-    # collapse multiple spaces
-    it2 = re.sub(r"\s{2,}", " ", it2)
-    return it2
-
-def extract_roles(cell: str) -> List[str]:
-    if not isinstance(cell, str):
-        return []
-    roles = []
-    for m in ROLE_RE.finditer(cell):
-        items = split_items(m.group(1))
-        for it in items:
-            itc = clean_item(it)
-            if itc:
-                roles.append(itc)
-    return sorted(set(roles))
-
-def extract_org_groups_practices(cell: str):
+def clean_items(items: pd.Series) -> pd.Series:
+    # remove surrounding parentheses, stray quotes and whitespace (EDGE_RE's \s covers what str.strip would),
+    # then collapse multiple spaces - which can't leave a space at either end
+    return items.str.replace(EDGE_RE, "", regex=True).str.replace(SPACES_RE, " ", regex=True)
+
+def strip_suffix(names: pd.Series, suffix_re: re.Pattern) -> pd.Series:
+    # strip "(Group)"/"(Practice)" or similar; if stripping leaves nothing, keep the cleaned item.
+    # Only these names need a last whitespace trim (suffix removal can leave a tab behind)
+    stripped = names.str.replace(suffix_re, "", regex=True).str.strip(" -,:;")
+    return stripped.where(stripped != "", names).str.strip()
+
+def collect(items: pd.Series, n_cells: int) -> list:
+    """Per-cell frozensets of the (already trimmed) items; names are interned, so every item naming
+    the same role/group/practice shares one string object."""
+    items = items[items != ""].map(sys.intern)
+    sets = [frozenset()] * n_cells
+    for pos, names in items.groupby(level=0):
+        sets[pos] = frozenset(names)
+    return sets
+
+def parse_cells(cells) -> dict:
     """
-    From Organisation(...) return two lists: groups, practices.
-    If an item has explicit suffix '(Group)' or '(Practice)' it is placed accordingly.
-    If no suffix present, treat it as Group (conservative to populate filters).
+    Column B text -> (groups, practices, roles), each a frozenset (deduped, unordered), for every distinct text.
+    All texts are parsed together with pandas' string kernels rather than cell by cell.
+    Organisation items with an explicit '(Group)' or '(Practice)' suffix are placed accordingly;
+    items without a suffix are treated as Groups (conservative to populate filters).
     """
-    if not isinstance(cell, str):
-        return [], []
-    groups = []
-    practices = []
-    for m in ORG_RE.finditer(cell):
-        items = split_items(m.group(1))
-        for it in items:
-            it_clean = clean_item(it)
-            if it_clean == "":
-                continue
-            # detect explicit suffix anywhere
-            if re.search(r"\bgroup\b", it, flags=re.I):
-                # strip trailing "(Group)" or similar
-                name = re.sub(r"\(?\s*group\s*\)?", "", it_clean, flags=re.I).strip(" -,:;")
-                if name:
-                    groups.append(name)
-                else:
-                    # if stripping left nothing, keep the original cleaned
-                    groups.append(it_clean)
-            elif re.search(r"\bpractice\b", it, flags=re.I):
-                name = re.sub(r"\(?\s*practice\s*\)?", "", it_clean, flags=re.I).strip(" -,:;")
-                if name:
-                    practices.append(name)
-                else:
-                    practices.append(it_clean)
-            else:
-                # no explicit suffix -> treat as Group (so filter populates)
-                groups.append(it_clean)
-    # dedupe & sort
-    groups_u = sorted(set([g for g in groups if g]))
-    practices_u = sorted(set([p for p in practices if p]))
-    return groups_u, practices_u
+    texts = pd.Series(pd.unique(np.asarray(cells, dtype=object)), dtype=object)
+    # one row per match; the index's first level is the text's position
+    found = texts.str.extractall(CELL_RE).droplevel(1)
+    roles = clean_items(split_items(found["roles"]))
+    orgs = split_items(found["orgs"])
+    orgs_clean = clean_items(orgs)
+    keep = orgs_clean != ""
+    orgs, orgs_clean = orgs[keep], orgs_clean[keep]
+    # detect explicit suffix anywhere; no suffix -> treat as Group (so filter populates)
+    has_group = orgs.str.contains(GROUP_WORD_RE)
+    is_practice = ~has_group & orgs.str.contains(PRACTICE_WORD_RE)
+    groups = orgs_clean.where(~has_group, strip_suffix(orgs_clean, GROUP_SUFFIX_RE))[~is_practice]
+    practices = strip_suffix(orgs_clean[is_practice], PRACTICE_SUFFIX_RE)
+    n = len(texts)
+    return dict(zip(texts, zip(collect(groups, n), collect(practices, n), collect(roles, n))))
 
 # -------------------------
 # Load Excel and columns A..E with header-row cleanup (improved)
+# Loading and parsing are cached on the file's mtime, so filter clicks only re-run the filtering.
+# DataFrames stay in cache_data (each caller gets its own copy); only the immutable Arrow arrays, tuples and
+# read-only NumPy arrays derived from them are shared across sessions (cache_resource, bounded).
 # -------------------------
-xls = pd.ExcelFile(EXCEL_PATH)
-sheet_name = xls.sheet_names[0]
-raw = pd.read_excel(EXCEL_PATH, sheet_name=sheet_name, header=None, dtype=object)
-
-# require at least 5 columns (A-E)
-if raw.shape[1] < 5:
-    st.error(f"Expected at least 5 columns (A-E). Found {raw.shape[1]}.")
-    st.stop()
-
-# Drop fully empty rows
-raw = raw.dropna(how="all").reset_index(drop=True)
-
-# Heuristic: detect header-like rows in the first 10 rows and drop them.
+# Heuristic: header-like rows in the first 10 rows are detected and dropped.
 header_tokens = {
     "prescriptive", "prescriptive rule", "member selection", "member selection criteria",
     "course id", "course title", "curriculum", "curriculum title"
 }
-rows_to_drop = []
-for idx in range(min(10, raw.shape[0])):
-    # join first five columns as lower-case text
-    row_vals = " ".join([str(x).lower() for x in raw.iloc[idx, :5].tolist()])
-    for tok in header_tokens:
-        if tok in row_vals:
-            rows_to_drop.append(idx)
-            break
-
-if rows_to_drop:
-    raw = raw.drop(rows_to_drop).reset_index(drop=True)
-    st.write(f"Dropped header-like row(s): {rows_to_drop}")
-
-# After header cleanup, drop any remaining rows that have all five source columns empty
-raw = raw[~(raw.iloc[:, :5].isnull().all(axis=1))].reset_index(drop=True)
-
-# Extract columns A..E
-prescriptive = raw.iloc[:, 0].astype(object).fillna("").astype(str)
-member_criteria = raw.iloc[:, 1].astype(object).fillna("").astype(str)
-course_id_col = raw.iloc[:, 2].astype(object).fillna("").astype(str)
-course_title_col = raw.iloc[:, 3].astype(object).fillna("").astype(str)
-curriculum_title_col = raw.iloc[:, 4].astype(object).fillna("").astype(str)
-
-nrows = len(raw)
-st.write(f"Loaded {nrows} data rows (after header cleanup).")
+# one alternation over all tokens, as a plain pattern so Arrow's regex kernel can run it
+HEADER_PATTERN = "|".join(re.escape(tok) for tok in header_tokens)
 
-# -------------------------
-# Group rows by prescriptive rule (global duplicates -> curriculum)
-# -------------------------
-rule_to_indices = {}
-for idx, rule in enumerate(prescriptive):
-    key = rule.strip()
-    rule_to_indices.setdefault(key, []).append(idx)
-
-records = []
-
-def parse_row_attributes(index: int):
-    cell = member_criteria[index]
-    roles = extract_roles(cell)
-    groups, practices = extract_org_groups_practices(cell)
-    return groups, practices, roles
-
-for rule_key, indices in rule_to_indices.items():
-    # treat as curriculum if rule_key non-empty and appears more than once
-    if rule_key != "" and len(indices) > 1:
-        # curriculum record: prefer first non-empty curriculum title
-        curr_title = ""
-        for i in indices:
-            t = curriculum_title_col[i]
-            if isinstance(t, str) and t.strip() != "":
-                curr_title = t.strip()
-                break
-        if not curr_title:
-            curr_title = rule_key
-        agg_groups: Set[str] = set()
-        agg_practices: Set[str] = set()
-        agg_roles: Set[str] = set()
-        for i in indices:
-            g, p, r = parse_row_attributes(i)
-            agg_groups.update(g)
-            agg_practices.update(p)
-            agg_roles.update(r)
-        records.append({
-            "Title": curr_title.strip(),
-            "ID": "",
-            "Type": "curriculum",
-            "Groups": sorted(list(agg_groups)),
-            "Practices": sorted(list(agg_practices)),
-            "Roles": sorted(list(agg_roles)),
-            "SourceIndices": indices
-        })
-        # add course rows
-        for i in indices:
-            title = course_title_col[i].strip() if isinstance(course_title_col[i], str) else ""
-            cid = course_id_col[i].strip() if isinstance(course_id_col[i], str) else ""
-            g, p, r = parse_row_attributes(i)
-            records.append({
-                "Title": title.strip() if title else rule_key.strip(),
-                "ID": cid.strip(),
-                "Type": "course",
-                "Groups": sorted(list(g)),
-                "Practices": sorted(list(p)),
-                "Roles": sorted(list(r)),
-                "SourceIndex": i
-            })
-    else:
-        # single occurrence -> course
-        i = indices[0]
-        title = course_title_col[i].strip() if isinstance(course_title_col[i], str) else ""
-        cid = course_id_col[i].strip() if isinstance(course_id_col[i], str) else ""
-        g, p, r = parse_row_attributes(i)
-        fallback_title = ""
-        if isinstance(curriculum_title_col[i], str) and curriculum_title_col[i].strip():
-            fallback_title = curriculum_title_col[i].strip()
-        records.append({
-            "Title": (title if title else fallback_title if fallback_title else prescriptive[i].strip()),
-            "ID": cid,
+@st.cache_data(show_spinner=False)
+def load_sheet(path: str, mtime: float):
+    """First sheet without fully empty or header-like rows; returns (raw, dropped header row positions)."""
+    # First sheet by position, so the workbook isn't opened a second time just to list sheet names.
+    # Only columns A..E are kept, typed as Arrow-backed strings at read time (a callable, so narrower sheets
+    # still load and are reported by the width check)
+    raw = pd.read_excel(
+        path, sheet_name=0, header=None, usecols=lambda c: c < 5, dtype="string[pyarrow]", engine="calamine"
+    )
+
+    # Drop fully empty rows
+    raw = raw.dropna(how="all").reset_index(drop=True)
+
+    # first 10 rows (A..E) joined as text (blanks as ""), matched against all tokens at once;
+    # the match ignores case, so no lower-cased copy is made
+    head = raw.head(10)
+    row_vals = head.iloc[:, 0].str.cat(head.iloc[:, 1:], sep=" ", na_rep="")
+    rows_to_drop = row_vals.index[row_vals.str.contains(HEADER_PATTERN, case=False)].tolist()
+
+    # Only columns A..E were read, so the empty-row drop above already removed every row with all five
+    # source columns empty; dropping header rows can't create new ones
+    if rows_to_drop:
+        raw = raw.drop(rows_to_drop).reset_index(drop=True)
+    return raw, rows_to_drop
+
+@st.cache_data(show_spinner=False)
+def build_items(_raw: pd.DataFrame, path: str, mtime: float) -> pd.DataFrame:
+    """Curriculum and course records (Title, ID, Type, Groups, Practices, Roles) parsed from columns A..E."""
+    raw = _raw
+
+    # Columns A..E are already Arrow-backed strings (blanks -> ""); every column but B is only used trimmed,
+    # so it is stripped once here with the vectorized .str kernel
+    source = raw.iloc[:, :5].fillna("")
+    prescriptive = source.iloc[:, 0].str.strip()
+    member_criteria = source.iloc[:, 1]
+    course_id_col = source.iloc[:, 2].str.strip()
+    course_title_col = source.iloc[:, 3].str.strip()
+    curriculum_title_col = source.iloc[:, 4].str.strip()
+
+    # Group rows by prescriptive rule (global duplicates -> curriculum); a non-empty rule on more than one row
+    # is a curriculum, every other rule contributes its first row as a single course
+    rule_counts = prescriptive.map(prescriptive.value_counts())
+    first_seen = ~prescriptive.duplicated().to_numpy()
+    is_curriculum = ((rule_counts > 1) & (prescriptive != "")).to_numpy()
+    single_rows = np.flatnonzero(first_seen & ~is_curriculum)
+    curr_rows = np.flatnonzero(is_curriculum)
+    # each curriculum row's rule, identified by the rule's first row (records are ordered by it)
+    curr_first = prescriptive.index.to_series().groupby(prescriptive).transform("min").to_numpy()[curr_rows]
+
+    # Plain object arrays from here on: rows are gathered with fancy-index takes, not pandas __getitem__
+    prescriptive = prescriptive.to_numpy(dtype=object)
+    # Column B as codes into its distinct texts
+    cell_codes, cell_texts = pd.factorize(member_criteria.to_numpy(dtype=object))
+    course_id_col = course_id_col.to_numpy(dtype=object)
+    course_title_col = course_title_col.to_numpy(dtype=object)
+    curriculum_title_col = curriculum_title_col.to_numpy(dtype=object)
+
+    # Many rows share the same Column B text: each distinct cell is parsed once (results are immutable frozensets)
+    parsed_cells = parse_cells(cell_texts)
+    # Attribute sets per distinct text; every row - including curriculum rows used twice below - takes its
+    # sets by code (a NumPy gather, no per-row lookup)
+    text_groups, text_practices, text_roles = (
+        np.fromiter((parsed_cells[t][k] for t in cell_texts), dtype=object, count=len(cell_texts)) for k in range(3)
+    )
+
+    def course_records(rows, titles, order):
+        """One course record per row position, built column-wise."""
+        codes = cell_codes[rows]
+        return pd.DataFrame({
+            "Title": titles,
+            "ID": course_id_col[rows],
             "Type": "course",
-            "Groups": sorted(list(g)),
-            "Practices": sorted(list(p)),
-            "Roles": sorted(list(r)),
-            "SourceIndex": i
+            "Groups": text_groups[codes],
+            "Practices": text_practices[codes],
+            "Roles": text_roles[codes],
+            "SourceIndex": rows,
+            "SourceIndices": None,
+            "_order": order,
+            "_sub": 1,
         })
 
-# -------------------------
-# Remove records with empty Title and normalize list fields
-# -------------------------
-cleaned = []
-for r in records:
-    title = r.get("Title", "")
-    if not isinstance(title, str) or title.strip() == "":
-        continue
-    # ensure lists exist
-    for L in ("Groups", "Practices", "Roles"):
-        if L not in r or r[L] is None:
-            r[L] = []
-        else:
-            # ensure strings trimmed
-            r[L] = [str(x).strip() for x in r[L] if str(x).strip()]
-    cleaned.append(r)
+    # Single courses: title falls back to the curriculum title, then to the rule itself
+    single_titles = course_title_col[single_rows]
+    single_titles = np.where(
+        single_titles != "", single_titles,
+        np.where(curriculum_title_col[single_rows] != "", curriculum_title_col[single_rows], prescriptive[single_rows]),
+    )
+    singles_df = course_records(single_rows, single_titles, single_rows)
+
+    # Curriculum course rows: title falls back to the rule
+    curr_courses_df = course_records(
+        curr_rows,
+        np.where(course_title_col[curr_rows] != "", course_title_col[curr_rows], prescriptive[curr_rows]),
+        curr_first,
+    )
+
+    # Curriculum records, one groupby over their course rows: first non-empty curriculum title (else the rule),
+    # union of the rows' attributes and the list of source rows
+    def union(sets):
+        return frozenset().union(*sets)
+
+    curr_titles = pd.Series(curriculum_title_col[curr_rows], index=curr_courses_df.index)
+    curricula_df = (
+        curr_courses_df.assign(
+            _title=curr_titles.where(curr_titles != ""),
+            _rule=prescriptive[curr_rows],
+        )
+        .groupby("_order", sort=False)
+        .agg(
+            _title=("_title", "first"),
+            _rule=("_rule", "first"),
+            Groups=("Groups", union),
+            Practices=("Practices", union),
+            Roles=("Roles", union),
+            SourceIndices=("SourceIndex", lambda rows: rows.tolist()),
+        )
+    )
+    curricula_df = pd.DataFrame({
+        "Title": curricula_df["_title"].fillna(curricula_df["_rule"]),
+        "ID": "",
+        "Type": "curriculum",
+        "Groups": curricula_df["Groups"],
+        "Practices": curricula_df["Practices"],
+        "Roles": curricula_df["Roles"],
+        "SourceIndex": None,
+        "SourceIndices": curricula_df["SourceIndices"],
+        "_order": curricula_df.index,
+        "_sub": 0,
+    })
+
+    # Records in order of their rule's first row, a curriculum ahead of its courses (stable: courses keep row order)
+    out_df = (
+        pd.concat([singles_df, curricula_df, curr_courses_df], ignore_index=True)
+        .sort_values(["_order", "_sub"], kind="stable")
+        .drop(columns=["_order", "_sub"])
+    )
+
+    # Remove records with empty Title (titles are already trimmed)
+    out_df = out_df[out_df["Title"] != ""].reset_index(drop=True)
+    # Arrow-backed text columns go to st.dataframe without an object -> Arrow conversion on every render
+    return out_df.astype({"Title": "string[pyarrow]", "ID": "string[pyarrow]", "Type": "string[pyarrow]"})
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def row_lists(_out_df: pd.DataFrame, path: str, mtime: float):
+    """Practices / Groups / Roles of every item as sorted Arrow list<string> arrays, built once per file version.
+
+    Sorting is left until here (none while records are built), and most items share their cell's set,
+    so each distinct set is sorted only once.
+    """
+    lists = {}
+    for col in ("Practices", "Groups", "Roles"):
+        sets = _out_df[col].tolist()
+        sorted_sets = {s: sorted(s) for s in set(sets)}
+        lists[col] = pa.array([sorted_sets[s] for s in sets], type=pa.list_(pa.string()))
+    # shared by every session: a read-only view, the Arrow arrays themselves are immutable
+    return MappingProxyType(lists)
 
-out_df = pd.DataFrame(cleaned)
+# flatten, unique and the case-insensitive (stable) sort are all Arrow kernels; only the result becomes Python
+def distinct_values(lists: pa.ListArray) -> tuple:
+    values = pc.unique(pc.list_flatten(lists))
+    return tuple(values.take(pc.array_sort_indices(pc.utf8_lower(values))).to_pylist())
 
-# ensure list columns are present
-for col in ["Groups", "Practices", "Roles"]:
-    if col not in out_df.columns:
-        out_df[col] = [[] for _ in range(len(out_df))]
+@st.cache_resource(show_spinner=False, max_entries=4)
+def filter_options(_lists, path: str, mtime: float):
+    """Alphabetical (practices, groups, roles) offered by the filters, as shared immutable tuples."""
+    return distinct_values(_lists["Practices"]), distinct_values(_lists["Groups"]), distinct_values(_lists["Roles"])
+
+ITEM_SET_COLS = ("Groups", "Practices", "Roles")
+
+# Bump whenever load_sheet / parse_cells / build_items change what they produce (invalidates the Parquet snapshots)
+ITEMS_VERSION = 1
+
+@st.cache_data(show_spinner=False)
+def load_items(path: str, mtime: float):
+    """(out_df, sheet info) for the workbook, preferring its Parquet snapshot for this workbook version.
+
+    sheet info holds the sheet's column count, data row count and dropped header rows;
+    out_df is None when the sheet has fewer than 5 columns. The snapshot's file name carries ITEMS_VERSION and
+    the workbook's mtime and only an exact match is read, so neither a change to the parsing nor a workbook
+    replaced by an older-dated file (cp -p, a restored backup) reads another version's items.
+    """
+    cache_path = f"{path}.items.v{ITEMS_VERSION}.{mtime:.0f}.parquet"
+    if os.path.exists(cache_path):
+        table = pq.read_table(cache_path)
+        info = json.loads(table.schema.metadata[b"sheet_info"])
+        out_df = table.to_pandas().astype({col: "string[pyarrow]" for col in ("Title", "ID", "Type")})
+        # list columns read back as arrays: restore the frozensets (interned) and plain row lists
+        for col in ITEM_SET_COLS:
+            out_df[col] = [frozenset(map(sys.intern, names)) for names in out_df[col]]
+        out_df["SourceIndices"] = [None if rows is None else rows.tolist() for rows in out_df["SourceIndices"]]
+        return out_df, info
+
+    raw, rows_to_drop = load_sheet(path, mtime)
+    info = {"ncols": raw.shape[1], "nrows": len(raw), "rows_to_drop": rows_to_drop}
+    if raw.shape[1] < 5:
+        return None, info
+    out_df = build_items(raw, path, mtime)
+    # sets are stored as sorted list<string> columns, so the snapshot round-trips losslessly
+    table = pa.Table.from_pandas(
+        out_df.assign(**{col: [sorted(names) for names in out_df[col]] for col in ITEM_SET_COLS}), preserve_index=False
+    )
+    table = table.replace_schema_metadata({**table.schema.metadata, b"sheet_info": json.dumps(info).encode()})
+    try:
+        pq.write_table(table, cache_path)
+    except OSError:
+        pass  # read-only checkout: keep the in-memory copy only
+    return out_df, info
+
+excel_mtime = os.path.getmtime(EXCEL_PATH)
+out_df, sheet_info = load_items(EXCEL_PATH, excel_mtime)
+
+# require at least 5 columns (A-E)
+if out_df is None:
+    st.error(f"Expected at least 5 columns (A-E). Found {sheet_info['ncols']}.")
+    st.stop()
+
+if sheet_info["rows_to_drop"]:
+    st.write(f"Dropped header-like row(s): {sheet_info['rows_to_drop']}")
+
+st.write(f"Loaded {sheet_info['nrows']} data rows (after header cleanup).")
 
 # -------------------------
 # Filter lists (alphabetical)
 # -------------------------
-all_practices = sorted({p for row in out_df["Practices"] for p in row}, key=lambda x: x.lower())
-all_groups = sorted({g for row in out_df["Groups"] for g in row}, key=lambda x: x.lower())
-all_roles = sorted({r for row in out_df["Roles"] for r in row}, key=lambda x: x.lower())
+item_lists = row_lists(out_df, EXCEL_PATH, excel_mtime)
+all_practices, all_groups, all_roles = filter_options(item_lists, EXCEL_PATH, excel_mtime)
 
 # -------------------------
-# UI layout: left filters, right table
+# Filter helpers
 # -------------------------
-left_col, right_col = st.columns([1, 3])
-
-def checkbox_list_unchecked(label: str, options: List[str], key_prefix: str) -> List[str]:
-    st.markdown(f"**{label}**")
-    selected = []
-    # if options empty, show caption
+def multiselect_filter(label: str, options: tuple, key: str) -> List[str]:
+    # One widget per filter (not a checkbox per value); empty by default
     if not options:
+        st.markdown(f"**{label}**")
         st.caption("No values found")
-        return selected
-    for i, opt in enumerate(options):
-        key = f"{key_prefix}__{i}"
-        checked = st.checkbox(opt, value=False, key=key)
-        if checked:
-            selected.append(opt)
-    return selected
-
-with left_col:
-    st.header("Filters")
-    selected_practices = checkbox_list_unchecked("Practice", all_practices, "flt_practice")
-    st.markdown("---")
-    selected_groups = checkbox_list_unchecked("Group", all_groups, "flt_group")
-    st.markdown("---")
-    selected_roles = checkbox_list_unchecked("Role", all_roles, "flt_role")
-    st.markdown("---")
-    st.write("Leave all checkboxes unchecked to include all values for that filter.")
-    st.write("Logic: OR within a filter, AND across filters.")
+        return []
+    return st.multiselect(label, options, default=[], key=key)
 
-# -------------------------
-# Apply filters
-# -------------------------
-def row_matches_filter_list(row_list: List[str], selected_list: List[str]) -> bool:
+@st.cache_resource(show_spinner=False, max_entries=4)
+def flat_values(_lists, path: str, mtime: float):
+    """Per attribute column: every item's values laid end to end as codes into the column's distinct values,
+    the distinct values themselves, and the item each value belongs to."""
+    flat = {}
+    for col, lists in _lists.items():
+        encoded = pc.list_flatten(lists).dictionary_encode()
+        codes = encoded.indices.to_numpy(zero_copy_only=False)
+        owners = pc.list_parent_indices(lists).to_numpy()
+        # shared by every session, so the NumPy arrays are made read-only
+        codes.setflags(write=False)
+        owners.setflags(write=False)
+        flat[col] = (codes, encoded.dictionary, owners)
+    return MappingProxyType(flat)
+
+def filter_mask(flat, n_items: int, selected_list: List[str]) -> np.ndarray:
+    """True where the item shares a value with the selection (OR within a filter); all True if none selected."""
     if not selected_list:
-        return True
-    if not row_list:
-        return False
-    return any(item in selected_list for item in row_list)
-
-mask = out_df.apply(
-    lambda r: (
-        row_matches_filter_list(r["Practices"], selected_practices) and
-        row_matches_filter_list(r["Groups"], selected_groups) and
-        row_matches_filter_list(r["Roles"], selected_roles)
-    ),
-    axis=1
-)
-filtered_df = out_df[mask].copy()
+        return np.ones(n_items, dtype=bool)
+    # the selection is probed once per distinct value, then every value picks up its answer by code
+    # and the hits are scattered back to their items
+    codes, distinct, owners = flat
+    selected = pc.is_in(distinct, value_set=pa.array(selected_list, type=pa.string())).to_numpy(zero_copy_only=False)
+    mask = np.zeros(n_items, dtype=bool)
+    mask[owners[selected[codes]]] = True
+    return mask
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def items_csv(_display_df: pd.DataFrame, path: str, mtime: float, practices, groups, roles) -> bytes:
+    """CSV bytes of the visible items, serialised once per filter selection."""
+    # Arrow's C++ writer straight into bytes (the columns are already Arrow-backed), no str -> bytes re-encode
+    csv_buf = io.BytesIO()
+    pacsv.write_csv(pa.Table.from_pandas(_display_df, preserve_index=False), csv_buf)
+    return csv_buf.getvalue()
 
 # -------------------------
-# Display results (Title, ID, Type) and CSV download
+# UI layout: left filters, right table
+# A fragment: applying filters reruns only this panel, not the load/parse part of the script
 # -------------------------
-with right_col:
-    st.subheader("Filtered Learning Items")
-    if filtered_df.empty:
-        st.info("No items match the current filters.")
-    else:
-        display_df = filtered_df[["Title", "ID", "Type"]].copy()
-        display_df["ID"] = display_df["ID"].replace("", "")
-        st.dataframe(display_df.reset_index(drop=True), use_container_width=True)
-        csv_buf = io.StringIO()
-        display_df.to_csv(csv_buf, index=False)
-        st.download_button(
-            label="Download visible items as CSV",
-            data=csv_buf.getvalue().encode(),
-            file_name="novotech_functional_training_filtered.csv",
-            mime="text/csv"
-        )
+@st.fragment
+def filter_panel(out_df: pd.DataFrame, item_lists, all_practices, all_groups, all_roles):
+    left_col, right_col = st.columns([1, 3])
+
+    with left_col:
+        st.header("Filters")
+        # inside a form, so picking several values costs one rerun (on Apply), not one per click
+        with st.form("filters"):
+            selected_practices = multiselect_filter("Practice", all_practices, "flt_practice")
+            st.markdown("---")
+            selected_groups = multiselect_filter("Group", all_groups, "flt_group")
+            st.markdown("---")
+            selected_roles = multiselect_filter("Role", all_roles, "flt_role")
+
+            st.form_submit_button("Apply filters")
+
+        st.markdown("---")
+        st.write("Leave a filter empty to include all values for that filter.")
+        st.write("Logic: OR within a filter, AND across filters.")
+
+    # AND across filters on plain NumPy masks; an empty filter costs nothing. Only the displayed columns are
+    # taken (a new frame, never the cached table itself), and rows by position (iloc), skipping boolean label
+    # alignment
+    item_values = flat_values(item_lists, EXCEL_PATH, excel_mtime)
+    masks = [
+        filter_mask(item_values[col], len(out_df), selected)
+        for col, selected in (("Practices", selected_practices), ("Groups", selected_groups), ("Roles", selected_roles))
+        if selected
+    ]
+    display_df = out_df[["Title", "ID", "Type"]]
+    if masks:
+        display_df = display_df.iloc[np.flatnonzero(np.logical_and.reduce(masks))]
+
+    # Display results (Title, ID, Type) and CSV download
+    with right_col:
+        st.subheader("Filtered Learning Items")
+        if display_df.empty:
+            st.info("No items match the current filters.")
+        else:
+            st.dataframe(display_df.reset_index(drop=True), use_container_width=True)
+            # the table is fully determined by the three selections, so the CSV is keyed on those
+            st.download_button(
+                label="Download visible items as CSV",
+                data=items_csv(
+                    display_df, EXCEL_PATH, excel_mtime,
+                    tuple(selected_practices), tuple(selected_groups), tuple(selected_roles),
+                ),
+                file_name="novotech_functional_training_filtered.csv",
+                mime="text/csv"
+            )
+
+    st.markdown("---")
+    st.write(f"Total parsed items: {len(out_df)}. Showing {len(display_df)} after filters.")
+
+filter_panel(out_df, item_lists, all_practices, all_groups, all_roles)
 
 # -------------------------
-# Summary & optional debug view
+# Optional debug view
 # -------------------------
-st.markdown("---")
-st.write(f"Total parsed items: {len(out_df)}. Showing {len(filtered_df)} after filters.")
+@st.cache_data(show_spinner=False)
+def debug_frame(_out_df: pd.DataFrame, _lists, path: str, mtime: float) -> pd.DataFrame:
+    """out_df with the attribute sets shown as comma-joined names, built once per file version."""
+    # the lists are already sorted, so each column is one binary_join kernel
+    return _out_df.assign(**{c: pc.binary_join(_lists[c], ", ").to_pandas() for c in ("Groups", "Practices", "Roles")})
+
 if st.checkbox("Show parsed items with attributes (debug)", value=False):
-    debug_df = out_df.copy()
-    for c in ["Groups", "Practices", "Roles"]:
-        debug_df[c] = debug_df[c].apply(lambda L: ", ".join(L) if isinstance(L, list) else "")
+    debug_df = debug_frame(out_df, item_lists, EXCEL_PATH, excel_mtime)
     st.dataframe(debug_df.reset_index(drop=True), use_container_width=True)
@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 import os
 
 # -------------------------------
@@ -14,7 +15,8 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 # LOAD EXCEL
 # -------------------------------
 # We use header=None because first 3 rows are merged/complex
-df = pd.read_excel(DATA_PATH, sheet_name=0, header=None)
+# Rust calamine parser (python-calamine is in requirements.txt)
+df = pd.read_excel(DATA_PATH, sheet_name=0, header=None, engine="calamine")
 
 # -------------------------------
 # EXTRACT GROUPS AND ROLES
@@ -33,44 +35,62 @@ for col, role in enumerate(roles, start=4):  # Column E = index 4
 # -------------------------------
 # EXTRACT SOPs PER ROLE
 # -------------------------------
+# SOPs start from row 4; columns A-D hold the SOP metadata
+meta = df.iloc[3:, :4]
+meta.columns = ["Business Unit", "SOP Type", "Number", "Title"]
+
+# Long format: one row per assigned (SOP row, role column) cell, found in one sweep of the grid
+grid = df.iloc[3:, 4:].to_numpy()
+rows, cols = np.nonzero(pd.notna(grid))
+marks = pd.Series(grid[rows, cols]).astype(str).str.strip()
+assigned = marks.isin(["1", "2", "3"]).to_numpy()  # Only assigned SOPs
+role_cols = pd.Series(cols[assigned] + 4)
+# Every assigned SOP becomes a record once; each role column just picks its positions (no sub-frame per role)
+records = meta.iloc[rows[assigned]].to_dict("records")
+positions_per_col = role_cols.groupby(role_cols, sort=False).indices
+
 sops_per_role = {}
+group_per_role = {}
 
 for info in role_info:
-    role_name = info["role"]
-    col = info["col"]
-    sops = []
-    
-    for idx, row in df.iloc[3:].iterrows():  # SOPs start from row 4
-        assigned = row[col]
-        if str(assigned).strip() in ["1", "2", "3"]:  # Only assigned SOPs
-            sops.append({
-                "Business Unit": row[0],
-                "SOP Type": row[1],
-                "Number": row[2],
-                "Title": row[3],
-                "Group": info["group"]
-            })
-    
-    sops_per_role[role_name] = sops
+    positions = positions_per_col.get(info["col"], [])
+    sops = [records[i] for i in positions]
+
+    sops_per_role[info["role"]] = sops
+    group_per_role[info["role"]] = info["group"]
 
 # -------------------------------
 # WRITE TXT FILES
 # -------------------------------
-import re
+from concurrent.futures import ThreadPoolExecutor
+
+# Characters not allowed in file names -> "_", replaced in one str.translate pass
+FILENAME_TABLE = str.maketrans({c: "_" for c in '<>:"/\\|?*'})
 
 def sanitize_filename(name):
-    return re.sub(r'[<>:"/\\|?*]', '_', str(name))
-
-for role, sops in sops_per_role.items():
-    safe_role_name = sanitize_filename(role)
-    file_path = os.path.join(OUTPUT_DIR, f"{safe_role_name}.txt")
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(f"SOPs for {role}:\n\n")
-        for sop in sops:
-            f.write(
-                f"- Business Unit: {sop['Business Unit']} | "
-                f"SOP Type: {sop['SOP Type']} | "
-                f"Number: {sop['Number']} | "
-                f"Title: {sop['Title']} | "
-                f"Group: {sop['Group']}\n"
-            )
\ No newline at end of file
+    return str(name).translate(FILENAME_TABLE)
+
+def write_role(role, sops):
+    file_path = os.path.join(OUTPUT_DIR, f"{sanitize_filename(role)}.txt")
+    # Every line carries its group, so each chunk of the file keeps that context once it is split;
+    # the group is the same for the whole role, so its field is formatted once
+    group_field = f" | Group: {group_per_role[role]}"
+    lines = [f"SOPs for {role}:", ""]
+    lines.extend(
+        f"- Business Unit: {sop['Business Unit']} | "
+        f"SOP Type: {sop['SOP Type']} | "
+        f"Number: {sop['Number']} | "
+        f"Title: {sop['Title']}{group_field}"
+        for sop in sops
+    )
+    # The body is joined once and goes out in a single write (1 MiB buffer)
+    with open(file_path, "w", encoding="utf-8", buffering=1 << 20) as f:
+        f.write("\n".join(lines) + "\n")
+
+# One file per sanitized name; if two roles sanitize to the same name the later one wins, as with
+# writing them in order, so the result doesn't depend on which thread finishes last
+role_per_file = {sanitize_filename(role): role for role in sops_per_role}
+
+# File writes are I/O bound (the GIL is released around them), so roles are written from a thread pool
+with ThreadPoolExecutor(max_workers=8) as pool:
+    list(pool.map(lambda role: write_role(role, sops_per_role[role]), role_per_file.values()))
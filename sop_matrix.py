@@ -0,0 +1,175 @@
+import os
+import re
+import streamlit as st
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# -------------------------------
+# Shared settings and helpers for the SOP matrix pages (app_exl.py, app_exl1.py).
+# Cached loaders live here so every page shares one cache entry per workbook version.
+# -------------------------------
+base_dir = os.path.dirname(__file__)
+excel_file_path = os.path.join(base_dir, "data", "Novotech_SOP_Matrix.xlsx")
+
+# Header rows (0-indexed):
+# - Group names row is HEADER_GROUP_ROW
+# - Column headers (Business Unit, SOP Type, Number, Title, Roles...) are in HEADER_COLS_ROW
+# - Data starts at DATA_START_ROW
+HEADER_GROUP_ROW = 0
+HEADER_COLS_ROW = 2
+DATA_START_ROW = 3  # zero-indexed (Excel row 4)
+
+category_map = {
+    "Within 2 weeks": 1,    # All staff SOPs
+    "Within 90 days": 2,    # Role-based SOPs
+    "Before task": 3        # Optional: before a particular task
+}
+
+regions = ["china", "korea", "taiwan", "hong kong", "india", "us", "uk"]  # extend as needed
+
+# One alternation over all region keywords, so each note is scanned once in C.
+# Longest keywords first, so a shorter keyword can't shadow a longer one starting at the same place.
+REGION_RE = re.compile(
+    "(" + "|".join(re.escape(r) for r in sorted(regions, key=len, reverse=True)) + ")", re.IGNORECASE
+)
+
+# -------------------------------
+# Helper functions
+# -------------------------------
+@st.cache_data(show_spinner=False)
+def list_sheets(path, mtime):
+    """Sheet names of the workbook; only re-read when the file changes."""
+    with pd.ExcelFile(path, engine="calamine") as xls:
+        return xls.sheet_names
+
+@st.cache_data(show_spinner=False)
+def read_workbook(path, mtime):
+    """Parse every sheet (no header) in a single pass over the workbook; cells as Arrow-backed strings."""
+    sheets = pd.read_excel(path, sheet_name=None, header=None, dtype=object, engine="calamine")
+    return {name: df.astype("string[pyarrow]") for name, df in sheets.items()}
+
+# Bump whenever read_workbook / the sheet copies change what they hold (invalidates the Parquet copies)
+SHEET_VERSION = 1
+
+def sheet_copy_path(path, key, mtime):
+    """Parquet copy of a sheet beside the workbook.
+
+    The name carries the workbook's mtime and only an exact match is read, so a workbook replaced by an
+    older-dated file (cp -p, a restored backup) never picks up another file's copy.
+    """
+    return f"{path}.{key}.v{SHEET_VERSION}.{mtime:.0f}.parquet"
+
+def read_sheet_copy(cache_path):
+    """(sheet name, sheet) from a Parquet copy written by write_sheet_copy."""
+    table = pq.read_table(cache_path)
+    raw = table.to_pandas().astype("string[pyarrow]")  # Parquet reads back as python strings
+    raw.columns = range(raw.shape[1])
+    return table.schema.metadata[b"sheet_name"].decode(), raw
+
+def write_sheet_copy(raw, sheet_name, cache_path):
+    """Keep a sheet (cells as nullable strings) as Parquet, with its sheet name in the file metadata."""
+    table = pa.Table.from_pandas(raw.set_axis(raw.columns.astype(str), axis=1), preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, b"sheet_name": sheet_name.encode()})
+    try:
+        pq.write_table(table, cache_path)
+    except OSError:
+        pass  # read-only checkout: keep the in-memory copy only
+
+@st.cache_data(show_spinner=False)
+def load_sheet(path, sheet_name, mtime):
+    """Load a sheet with no header as strings, preferring its Parquet copy for this workbook version."""
+    cache_path = sheet_copy_path(path, sheet_name, mtime)
+    if os.path.exists(cache_path):
+        return read_sheet_copy(cache_path)[1]
+    # Mixed-type object columns can't go to Parquet, so every cell is kept as a nullable string
+    raw = read_workbook(path, mtime)[sheet_name]
+    write_sheet_copy(raw, sheet_name, cache_path)
+    raw.columns = range(raw.shape[1])
+    return raw
+
+@st.cache_data(show_spinner=False)
+def load_first_sheet(path, mtime):
+    """(sheet name, first sheet) like load_sheet, without knowing the sheet name; None if there are no sheets.
+
+    Its Parquet copy is found by the workbook version alone, so a warm start opens neither the workbook
+    nor its sheet list; a cold start takes the first sheet from the single read_workbook pass.
+    """
+    cache_path = sheet_copy_path(path, "first-sheet", mtime)
+    if os.path.exists(cache_path):
+        return read_sheet_copy(cache_path)
+    workbook = read_workbook(path, mtime)
+    if not workbook:
+        return None
+    sheet_name, raw = next(iter(workbook.items()))
+    write_sheet_copy(raw, sheet_name, cache_path)
+    raw.columns = range(raw.shape[1])
+    return sheet_name, raw
+
+def fill_group_row(group_row):
+    """Forward-fill the group header row: names only sit on the first column of each merged block."""
+    group_arr = np.asarray(group_row, dtype=object)
+    fill_idx = np.where(pd.isna(group_arr), 0, np.arange(len(group_arr)))
+    np.maximum.accumulate(fill_idx, out=fill_idx)
+    return group_arr[fill_idx]
+
+def role_code_matrix(role_cells):
+    """int(float(v)) of a 2-D block of role cells as an int8 matrix.
+
+    Blanks, marks like "2;3" and values outside 0-127 become -1, which never matches a category code.
+    """
+    cells = np.asarray(role_cells, dtype=object)
+    nums = pd.to_numeric(pd.Series(cells.ravel(), dtype="string").str.strip(), errors="coerce")
+    codes = np.trunc(nums.to_numpy(dtype="float64", na_value=np.nan)).reshape(cells.shape)
+    codes[~((codes >= 0) & (codes <= 127))] = -1
+    return codes.astype(np.int8)
+
+def role_postings(codes, col_indices):
+    """(col_idx, category code) -> ascending row positions holding that code, from an int8 role matrix.
+
+    codes has one column per entry of col_indices; every pair gets an entry (possibly empty).
+    """
+    rows = {}
+    next_cols = np.arange(1, codes.shape[1])
+    for code in category_map.values():
+        # Transposed hits come out column by column with rows ascending; split them at the column boundaries
+        cols, hit_rows = np.nonzero((codes == code).T)
+        for col_idx, r in zip(col_indices, np.split(hit_rows, np.searchsorted(cols, next_cols))):
+            rows[(col_idx, code)] = r
+    return rows
+
+def build_groups_map(group_row, header_row):
+    """group name -> [(col_idx, role_name)] for the role columns (E onward), in column order.
+
+    group_row is the forward-filled group header row; blank/"nan"/"none" names become "Ungrouped".
+    """
+    group_arr = np.asarray(group_row, dtype=object)
+    group_names = pd.Series(group_arr[4:len(header_row)], index=np.arange(4, len(header_row)))
+    group_names = group_names.astype("string").str.strip().fillna("")
+    group_names = group_names.mask((group_names == "") | group_names.str.lower().isin(["nan", "none"]), "Ungrouped")
+    return {
+        g: [(col_idx, header_row[col_idx]) for col_idx in idxs]
+        for g, idxs in group_names.groupby(group_names, sort=False).groups.items()
+    }
+
+def region_hits(notes):
+    """Boolean note x region matrix (columns in `regions` order) from one regex pass over the notes.
+
+    Notes repeat a lot across SOPs, so only the distinct texts are scanned; rows take their text's hits.
+    """
+    codes, uniques = pd.factorize(notes.astype("string"))  # blank notes -> code -1
+    found = pd.Series(uniques, dtype="string").str.extractall(REGION_RE)[0].str.lower()
+    hits = pd.crosstab(found.index.get_level_values(0), found) if len(found) else pd.DataFrame()
+    hits = hits.reindex(index=range(len(uniques)), columns=regions, fill_value=0).to_numpy(dtype=bool)
+    # Trailing all-False row so code -1 (no note) picks up no regions
+    hits = np.vstack([hits, np.zeros((1, len(regions)), dtype=bool)])
+    return pd.DataFrame(hits[codes], index=notes.index, columns=regions)
+
+def region_labels(hits):
+    """Comma-joined regions per row of a region_hits() matrix, in `regions` order; "" when none."""
+    return hits.dot(hits.columns + ", ").str.rstrip(", ")
+
+def detect_regions(notes):
+    """Comma-joined regions mentioned in each note, in `regions` order; "" when none."""
+    return region_labels(region_hits(notes))